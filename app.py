@@ -1,101 +1,290 @@
+# Patch the stdlib before anything else is imported so blocking network calls
+# (requests, Gemini over gRPC) yield to other greenlets
+from gevent import monkey
+monkey.patch_all()
+import grpc.experimental.gevent as grpc_gevent
+grpc_gevent.init_gevent()
+
 import os
-import json
+import re
+import logging
+import math
+import orjson
+import hashlib
 import time
+import threading
+from string import Template
+from concurrent.futures import ThreadPoolExecutor
+from typing_extensions import TypedDict
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import numpy as np
+import redis
+import faiss
 import google.generativeai as genai
-from flask import Flask, request, render_template, session, redirect, url_for, jsonify
+from flask import Flask, Response, request, render_template, session, redirect, url_for, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from flask_compress import Compress
+from flask_session import Session
 from flask_socketio import SocketIO, emit, join_room
 from dotenv import load_dotenv
 
 # ------------------- Setup -------------------
 load_dotenv()
+logger = logging.getLogger(__name__)
+
+class OrJSONProvider(DefaultJSONProvider):
+    """Serve and parse JSON with orjson, falling back to the stdlib provider
+    whenever Flask passes hooks orjson can't honour (e.g. the session
+    serializer's ``object_hook``)."""
+
+    _FORMAT_KWARGS = {"indent", "separators"}
+
+    def dumps(self, obj, **kwargs):
+        if not kwargs.keys() <= self._FORMAT_KWARGS:
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
 
 app = Flask(__name__)
+app.json = OrJSONProvider(app)
 # Allow all origins; adjust to your frontend domain if you prefer
 CORS(app, resources={r"/*": {"origins": "*"}})
 
+# gzip/brotli JSON and HTML responses; streamed (SSE) responses are left alone
+# so events are not held back in the compressor's buffer
+app.config["COMPRESS_MIMETYPES"] = ["application/json", "text/html"]
+app.config["COMPRESS_LEVEL"] = 5
+app.config["COMPRESS_STREAMS"] = False
+Compress(app)
+
 app.secret_key = os.getenv("SECRET_KEY", "supersecretkey")  # For session management
-socketio = SocketIO(app, cors_allowed_origins="*")
+
+# One Redis connection pool backs both the session store and the shared caches
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Short timeouts so an unreachable Redis degrades to cache misses instead of
+# stalling every request behind a hung socket
+_redis = redis.Redis(connection_pool=redis.ConnectionPool.from_url(
+    REDIS_URL,
+    max_connections=64,
+    socket_connect_timeout=0.5,
+    socket_timeout=1,
+    health_check_interval=30,
+))
+
+# Keep session data in Redis so only the session id travels in the cookie
+app.config.update(
+    SESSION_TYPE="redis",
+    SESSION_REDIS=_redis,
+    SESSION_PERMANENT=False,
+    SESSION_USE_SIGNER=True,
+)
+Session(app)
+
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode="gevent")
 
 # Load Google Gemini API Key
 GEMINI_API_KEY = os.getenv("GOOGLE_API_KEY")
 if not GEMINI_API_KEY:
     raise ValueError("❌ Google Gemini API Key is missing! Set 'GOOGLE_API_KEY' in your .env file.")
 genai.configure(api_key=GEMINI_API_KEY)
+MODEL = genai.GenerativeModel("gemini-2.0-flash")
 
 # Google Maps API key for clinics lookup
 MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
 
-# ------------------- Text Prediction using Gemini -------------------
-def predict_disease_from_text(description):
-    prompt = f"""
-You are a medical expert. Predict the top 5 possible skin diseases based on this description:
-'{description}'
-Return JSON format:
-[
-    {{"disease": "Disease Name", "score": 0.8}},
-    {{"disease": "Another Disease", "score": 0.6}}
-]
-    """
-    response = genai.GenerativeModel("gemini-2.0-flash").generate_content(prompt).text
+# Shared HTTP session so outgoing Maps calls reuse keep-alive connections
+_http = requests.Session()
+_http.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=32,
+    max_retries=Retry(total=2, backoff_factor=0.2),
+))
+
+# Worker pool for fanning out the clinic searches; kept apart from the slow
+# speculative LLM work so Maps lookups never queue behind it
+_maps_executor = ThreadPoolExecutor(max_workers=16)
+
+# ------------------- Shared Cache -------------------
+# Cached LLM responses and geocodes live in Redis so every worker shares them.
+# Redis being unavailable only costs us cache hits, never a failed request.
+LLM_CACHE_TTL = 24 * 3600
+
+def _key(s):
+    return hashlib.blake2b(s.encode(), digest_size=16).hexdigest()
+
+def cache_get(key):
     try:
-        return json.loads(response)
-    except json.JSONDecodeError:
-        return []
+        value = _redis.get(key)
+    except redis.RedisError:
+        return None
+    return orjson.loads(value) if value is not None else None
 
-def generate_followup_questions(predictions):
-    prompt = f"""
-Given these possible skin diseases based on the text input:
-{json.dumps(predictions, indent=2)}
-Generate 3-5 follow-up medical questions to refine the final diagnosis.
-Return ONLY plain text questions separated by new lines.
+def cache_set(key, value, ttl):
+    try:
+        _redis.set(key, orjson.dumps(value), ex=ttl)
+    except redis.RedisError:
+        pass
+
+# ------------------- Health Chat Cache -------------------
+# Exact matches on the normalized question are served straight from Redis;
+# otherwise a close enough earlier question (by embedding similarity) reuses
+# its answer. Semantic entries go into a capped Redis stream whose ids are
+# monotonic and carry a timestamp; each worker tails the stream into its own
+# FAISS index and ignores entries older than CHAT_CACHE_TTL.
+CHAT_CACHE_TTL = 7 * 86400
+# Versioned: the previous unbounded list layout lived at "lm:chat:semantic"
+SEMANTIC_CACHE_KEY = "lm:chat:semantic:v2"
+SEMANTIC_CACHE_MAX = 10_000
+EMBEDDING_MODEL = "models/text-embedding-004"
+EMBEDDING_DIM = 768
+SEMANTIC_THRESHOLD = 0.92
+# Expired rows are dropped from the local index in batches of at least this size
+_SEMANTIC_COMPACT_BATCH = 1000
+
+_semantic_index = faiss.IndexFlatIP(EMBEDDING_DIM)
+_semantic_entries = []  # (created_ms, answer), one per row of _semantic_index
+_semantic_last_id = "0-0"
+_semantic_lock = threading.Lock()
+
+def _normalize_question(question):
+    text = re.sub(r"[^\w\s]", " ", question.lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+def _embed(text):
+    result = genai.embed_content(model=EMBEDDING_MODEL, content=text, task_type="semantic_similarity")
+    vector = np.asarray(result["embedding"], dtype="float32").reshape(1, -1)
+    faiss.normalize_L2(vector)
+    return vector
+
+def _semantic_cutoff_ms():
+    return int(time.time() * 1000) - CHAT_CACHE_TTL * 1000
+
+def _compact_semantic_index():
+    """Rebuild the local index without expired or over-cap rows."""
+    global _semantic_index, _semantic_entries
+    cutoff = _semantic_cutoff_ms()
+    # Entries arrive in stream order, so the expired ones form a prefix
+    first = 0
+    while first < len(_semantic_entries) and _semantic_entries[first][0] < cutoff:
+        first += 1
+    first = max(first, len(_semantic_entries) - SEMANTIC_CACHE_MAX)
+    if first == 0 or (first < _SEMANTIC_COMPACT_BATCH and first < len(_semantic_entries)):
+        return
+    index = faiss.IndexFlatIP(EMBEDDING_DIM)
+    if first < _semantic_index.ntotal:
+        index.add(_semantic_index.reconstruct_n(first, _semantic_index.ntotal - first))
+    _semantic_index, _semantic_entries = index, _semantic_entries[first:]
+
+def _sync_semantic_cache():
+    """Pull semantic cache entries added since the last sync into the local index."""
+    global _semantic_last_id
+    with _semantic_lock:
+        try:
+            rows = _redis.xrange(SEMANTIC_CACHE_KEY, min="(" + _semantic_last_id, count=SEMANTIC_CACHE_MAX)
+        except redis.RedisError:
+            return
+        for entry_id, fields in rows:
+            _semantic_last_id = entry_id.decode()
+            answer = fields[b"answer"].decode()
+            if not answer:
+                continue
+            vector = np.frombuffer(fields[b"vector"], dtype="float32").reshape(1, -1)
+            _semantic_index.add(vector)
+            _semantic_entries.append((int(_semantic_last_id.split("-")[0]), answer))
+        _compact_semantic_index()
+
+def cached_health_answer(normalized):
+    """Look up an answer for a normalized question.
+
+    Returns ``(answer, vector)``; ``answer`` is None on a miss and ``vector`` is
+    the question embedding (if one could be computed) for storing the result.
     """
-    response = genai.GenerativeModel("gemini-2.0-flash").generate_content(prompt).text
-    questions = response.strip().split("\n")
-    return [q for q in questions if q.strip() != ""]
+    exact_key = "lm:chat:" + _key(normalized)
+    answer = cache_get(exact_key)
+    if answer:
+        return answer, None
 
-# ------------------------------------------------------------------------------
-#  API Endpoints
-# ------------------------------------------------------------------------------
-
-@app.route("/api/analyze", methods=["POST"])
-def analyze():
-    text_description = request.form.get("description")
-    final_predictions = []
+    try:
+        vector = _embed(normalized)
+    except Exception:
+        return None, None
+
+    _sync_semantic_cache()
+    answer = None
+    cutoff = _semantic_cutoff_ms()
+    with _semantic_lock:
+        if _semantic_index.ntotal:
+            # A few neighbours, in case the nearest ones have expired
+            scores, ids = _semantic_index.search(vector, 4)
+            for score, row in zip(scores[0], ids[0]):
+                if row < 0 or score < SEMANTIC_THRESHOLD:
+                    break
+                created_ms, candidate = _semantic_entries[row]
+                if created_ms >= cutoff:
+                    answer = candidate
+                    break
+    if answer is not None:
+        # Expire the exact-match copy together with the entry it came from
+        remaining = (created_ms - cutoff) // 1000
+        if remaining > 0:
+            cache_set(exact_key, answer, remaining)
+    return answer, vector
+
+def remember_health_answer(normalized, vector, answer):
+    # An empty reply would otherwise be served to every matching question
+    if not answer:
+        return
+    cache_set("lm:chat:" + _key(normalized), answer, CHAT_CACHE_TTL)
+    if vector is None:
+        return
+    try:
+        with _redis.pipeline() as pipe:
+            pipe.xadd(
+                SEMANTIC_CACHE_KEY,
+                {"vector": vector.tobytes(), "answer": answer},
+                maxlen=SEMANTIC_CACHE_MAX,
+                approximate=True,
+            )
+            pipe.expire(SEMANTIC_CACHE_KEY, CHAT_CACHE_TTL)
+            pipe.execute()
+    except redis.RedisError:
+        pass
 
-    if text_description:
-        text_predictions = predict_disease_from_text(text_description)
-        final_predictions.extend(text_predictions)
+_sync_semantic_cache()
 
-    followup_questions = generate_followup_questions(final_predictions)
+# ------------------- Prompts -------------------
+# Static instructions go first and dynamic content only after the separator, so
+# every request shares a byte-identical prefix that Gemini can cache implicitly.
+PROMPT_SEPARATOR = "\n\n---\n\n"
 
-    return jsonify({
-        "predictions": final_predictions,
-        "followup_questions": followup_questions
-    })
+def _compact_json(obj):
+    # No indentation: whitespace only costs input tokens
+    return orjson.dumps(obj).decode()
 
-@app.route("/api/final-diagnosis", methods=["POST"])
-def final_diagnosis_api():
-    data = request.json
-    predictions = data.get("predictions", [])
-    user_answers = data.get("user_answers", {})
+PREDICTION_SYSTEM = """You are a medical expert. Predict the top 5 possible skin diseases based on the user's description below.
+Return JSON format:
+[
+    {"disease": "Disease Name", "score": 0.8},
+    {"disease": "Another Disease", "score": 0.6}
+]"""
 
-    prompt = f"""
-Based on these AI predictions:
-{json.dumps(predictions, indent=2)}
-And user responses:
-{json.dumps(user_answers, indent=2)}
-Determine the final skin disease.
-Return ONLY the final disease name in plain text.
-    """
-    
-    final_disease = genai.GenerativeModel("gemini-2.0-flash").generate_content(prompt).text.strip()
+FOLLOWUP_SYSTEM = """You are a medical expert. Given the possible skin diseases below, predicted from the user's text input, generate 3-5 follow-up medical questions to refine the final diagnosis.
+Return ONLY plain text questions separated by new lines."""
 
-    treatment_prompt = f"""
-You are a medical assistant. Provide a structured and easy-to-understand treatment plan for the following skin condition:
+FINAL_DISEASE_SYSTEM = """You are a medical expert. Based on the AI predictions and the user's responses to follow-up questions below, determine the final skin disease.
+Return ONLY the final disease name in plain text."""
 
-**Disease:** {final_disease}
+TREATMENT_SYSTEM = """You are a medical assistant. Provide a structured and easy-to-understand treatment plan for the skin condition named below.
 
 Respond using this exact format. Each section should have **2–3 short bullet points**. Keep the explanations **simple, practical, and relevant for a general audience**.
 
@@ -118,13 +307,327 @@ Respond using this exact format. Each section should have **2–3 short bullet p
 
 **When to See a Doctor:**
 • [Early warning sign]
-• [Progression or worsening symptom]
-    """
-    
+• [Progression or worsening symptom]"""
+
+HEALTH_CHAT_SYSTEM = """You are a women's health assistant. Answer the user's question below.
+
+Reply with a **short, concise answer (1–2 sentences max)**.
+Focus on:
+• Quick explanation
+• 1–2 key tips
+• When to see a doctor
+
+If the question isn't about women's health, politely decline.
+Return your response in **plain text** only."""
+
+# Full prompts, built once; only the fields after the separator vary per request
+PREDICTION_TEMPLATE = Template(PREDICTION_SYSTEM + PROMPT_SEPARATOR + "User description: $description")
+FOLLOWUP_TEMPLATE = Template(FOLLOWUP_SYSTEM + PROMPT_SEPARATOR + "Possible diseases:\n$predictions_json")
+FINAL_DISEASE_TEMPLATE = Template(
+    FINAL_DISEASE_SYSTEM + PROMPT_SEPARATOR
+    + "AI predictions:\n$predictions_json\nUser responses:\n$answers_json"
+)
+TREATMENT_TEMPLATE = Template(TREATMENT_SYSTEM + PROMPT_SEPARATOR + "**Disease:** $disease")
+HEALTH_CHAT_TEMPLATE = Template(HEALTH_CHAT_SYSTEM + PROMPT_SEPARATOR + "User question: $question")
+
+# ------------------- Text Prediction using Gemini -------------------
+# typing_extensions' TypedDict: the SDK builds the schema with pydantic, which
+# rejects typing.TypedDict before Python 3.12
+class DiseasePrediction(TypedDict):
+    disease: str
+    score: float
+
+# Ask Gemini for schema-conforming JSON so the answer doesn't need to be fished
+# out of markdown fences or surrounding prose
+PREDICTION_CONFIG = genai.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=list[DiseasePrediction],
+)
+
+def _parse_predictions(response):
+    match = re.search(r"\[.*\]", response, re.DOTALL)
     try:
-        treatment_response = genai.GenerativeModel("gemini-2.0-flash").generate_content(treatment_prompt).text.strip()
+        predictions = orjson.loads(match.group(0) if match else response)
+    except orjson.JSONDecodeError:
+        return []
+    if isinstance(predictions, list) and all(isinstance(p, dict) for p in predictions):
+        return predictions
+    return []
+
+def predict_disease_from_text(description):
+    cache_key = "lm:pred:" + _key(description)
+    cached = cache_get(cache_key)
+    if cached is not None:
+        return cached
+
+    prompt = PREDICTION_TEMPLATE.substitute(description=description)
+    try:
+        response = MODEL.generate_content(prompt, generation_config=PREDICTION_CONFIG).text
+    except Exception as e:
+        logger.error("Disease prediction failed: %s", e)
+        return []
+    predictions = _parse_predictions(response)
+    if not predictions:
+        return []
+    cache_set(cache_key, predictions, LLM_CACHE_TTL)
+    return predictions
+
+def generate_followup_questions(predictions):
+    if not predictions:
+        return []
+
+    cache_key = "lm:followup:" + _key(orjson.dumps(predictions, option=orjson.OPT_SORT_KEYS).decode())
+    cached = cache_get(cache_key)
+    if cached is not None:
+        return cached
+
+    prompt = FOLLOWUP_TEMPLATE.substitute(predictions_json=_compact_json(predictions))
+    response = MODEL.generate_content(prompt).text
+    questions = response.strip().split("\n")
+    questions = [q for q in questions if q.strip() != ""]
+    # A blank reply shouldn't pin this prediction set to "no questions" for a day
+    if questions:
+        cache_set(cache_key, questions, LLM_CACHE_TTL)
+    return questions
+
+# ------------------- Treatment Plans -------------------
+TREATMENT_UNAVAILABLE = "⚠️ Unable to fetch treatment details. Please consult a dermatologist."
+
+# Treatment plans requested ahead of the final diagnosis, keyed by disease name
+_prefetched_treatments = {}
+_prefetch_lock = threading.Lock()
+_PREFETCH_LIMIT = 256
+
+# Prefetches are best-effort: they get their own pool, and when every worker
+# is busy new ones are skipped rather than queued behind the others
+_PREFETCH_WORKERS = 8
+_prefetch_executor = ThreadPoolExecutor(max_workers=_PREFETCH_WORKERS)
+_prefetch_slots = threading.BoundedSemaphore(_PREFETCH_WORKERS)
+
+def _disease_key(disease):
+    return disease.strip().strip(".").lower()
+
+def top_prediction(predictions):
+    ranked = [p for p in predictions if isinstance(p, dict) and p.get("disease")]
+    if not ranked:
+        return None
+    return max(ranked, key=lambda p: p.get("score") or 0)["disease"]
+
+def _treatment_prompt(final_disease):
+    return TREATMENT_TEMPLATE.substitute(disease=final_disease)
+
+def generate_treatment(final_disease):
+    return MODEL.generate_content(_treatment_prompt(final_disease)).text.strip()
+
+def prefetch_treatment(disease):
+    """Start generating a treatment plan in the background for a likely diagnosis."""
+    key = _disease_key(disease)
+    with _prefetch_lock:
+        if key in _prefetched_treatments:
+            return
+        if not _prefetch_slots.acquire(blocking=False):
+            return
+        if len(_prefetched_treatments) >= _PREFETCH_LIMIT:
+            _prefetched_treatments.pop(next(iter(_prefetched_treatments)))
+        future = _prefetch_executor.submit(generate_treatment, disease)
+        # Runs on completion or cancellation, so the slot is always returned
+        future.add_done_callback(lambda _: _prefetch_slots.release())
+        _prefetched_treatments[key] = future
+
+def _take_prefetched(final_disease):
+    with _prefetch_lock:
+        future = _prefetched_treatments.pop(_disease_key(final_disease), None)
+    # A prefetch that never got a worker is no head start; make the call directly
+    if future is not None and future.cancel():
+        return None
+    return future
+
+def stream_treatment(final_disease):
+    """Yield the treatment plan in pieces as Gemini generates it."""
+    future = _take_prefetched(final_disease)
+    try:
+        if future is not None:
+            yield future.result()
+            return
+        for chunk in MODEL.generate_content(_treatment_prompt(final_disease), stream=True):
+            yield chunk.text
     except Exception:
-        treatment_response = "⚠️ Unable to fetch treatment details. Please consult a dermatologist."
+        yield TREATMENT_UNAVAILABLE
+
+# ------------------- Final Diagnosis -------------------
+def determine_final_disease(predictions, user_answers):
+    # Speculatively build the treatment plan for the leading prediction while
+    # the final diagnosis is being decided
+    likely_disease = top_prediction(predictions)
+    if likely_disease:
+        prefetch_treatment(likely_disease)
+
+    prompt = FINAL_DISEASE_TEMPLATE.substitute(
+        predictions_json=_compact_json(predictions),
+        answers_json=_compact_json(user_answers),
+    )
+    return MODEL.generate_content(prompt).text.strip()
+
+def _final_diagnosis_key(predictions, user_answers):
+    return "lm:final:" + _key(orjson.dumps([predictions, user_answers], option=orjson.OPT_SORT_KEYS).decode())
+
+def _final_diagnosis_pieces(predictions, user_answers):
+    """Yield the final disease, then the treatment plan in pieces.
+
+    Cached results are replayed as a single piece; fresh ones are cached once
+    the whole plan has arrived. The last piece is ``TREATMENT_UNAVAILABLE`` if
+    the plan could not be generated.
+    """
+    cache_key = _final_diagnosis_key(predictions, user_answers)
+    cached = cache_get(cache_key)
+    if cached is not None:
+        final_disease, treatment = cached
+        yield final_disease
+        yield treatment
+        return
+
+    final_disease = determine_final_disease(predictions, user_answers)
+    yield final_disease
+    parts = []
+    for delta in stream_treatment(final_disease):
+        parts.append(delta)
+        yield delta
+    treatment = "".join(parts).strip()
+    if treatment and parts[-1] != TREATMENT_UNAVAILABLE:
+        cache_set(cache_key, (final_disease, treatment), LLM_CACHE_TTL)
+
+def _final_diagnosis_and_treatment(predictions, user_answers):
+    """Return ``(final_disease, treatment)`` for the predictions and follow-up answers."""
+    pieces = _final_diagnosis_pieces(predictions, user_answers)
+    final_disease = next(pieces)
+    parts = list(pieces)
+    if parts and parts[-1] == TREATMENT_UNAVAILABLE:
+        return final_disease, TREATMENT_UNAVAILABLE
+    return final_disease, "".join(parts).strip()
+
+# ------------------- Clinic Search -------------------
+PLACES_SEARCH_URL = "https://places.googleapis.com/v1/places:searchText"
+PLACES_FIELD_MASK = ",".join([
+    "places.id",
+    "places.displayName",
+    "places.formattedAddress",
+    "places.nationalPhoneNumber",
+    "places.websiteUri",
+    "places.rating",
+    "places.location",
+    "places.regularOpeningHours.weekdayDescriptions",
+])
+_CATEGORY_RANK = {"NGO": 0, "Government": 1, "Private": 2}
+# Largest circle the Places API accepts for a location bias
+PLACES_MAX_RADIUS = 50000.0
+
+def _distance_m(lat1, lng1, lat2, lng2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(a))
+
+GEOCODE_CACHE_TTL = 30 * 86400
+
+def geocode(address):
+    """Resolve an address to ``(lat, lng)``, or None if it can't be geocoded."""
+    cache_key = "geo:" + _key(re.sub(r"\s+", " ", address.strip().lower()))
+    cached = cache_get(cache_key)
+    if cached is not None:
+        return tuple(cached)
+
+    geocode_url = f"https://maps.googleapis.com/maps/api/geocode/json?address={address}&key={MAPS_API_KEY}"
+    geocode_data = _http.get(geocode_url, timeout=5).json()
+    if geocode_data.get("status") != "OK":
+        return None
+    location = geocode_data["results"][0]["geometry"]["location"]
+    coordinates = (location["lat"], location["lng"])
+    cache_set(cache_key, coordinates, GEOCODE_CACHE_TTL)
+    return coordinates
+
+def search_places(keyword, lat, lng, radius):
+    """Find hospitals matching ``keyword`` within ``radius`` metres of a point."""
+    body = {
+        "textQuery": keyword.strip(),
+        "includedType": "hospital",
+        "pageSize": 20,
+        "locationBias": {
+            "circle": {
+                "center": {"latitude": lat, "longitude": lng},
+                "radius": min(float(radius), PLACES_MAX_RADIUS),
+            }
+        },
+    }
+    headers = {"X-Goog-Api-Key": MAPS_API_KEY, "X-Goog-FieldMask": PLACES_FIELD_MASK}
+    response = _http.post(PLACES_SEARCH_URL, json=body, headers=headers, timeout=5)
+    if not response.ok:
+        # Usually the Places API (New) isn't enabled for the key, or the key is wrong
+        logger.error("Places search for %r failed (%s): %s", keyword, response.status_code, response.text)
+        response.raise_for_status()
+    places = response.json().get("places", [])
+    # Text Search only biases towards the circle, so drop anything outside it
+    return [
+        place for place in places
+        if "location" in place
+        and _distance_m(lat, lng, place["location"]["latitude"], place["location"]["longitude"]) <= radius
+    ]
+
+# ------------------------------------------------------------------------------
+#  API Endpoints
+# ------------------------------------------------------------------------------
+
+# Clients opt into Server-Sent Events with ?stream=1 or Accept: text/event-stream
+def _wants_stream():
+    return request.args.get("stream") == "1" or request.accept_mimetypes.best == "text/event-stream"
+
+def _sse(payload):
+    return f"data: {orjson.dumps(payload).decode()}\n\n"
+
+def _sse_response(events):
+    return Response(
+        stream_with_context(events),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.route("/api/analyze", methods=["POST"])
+def analyze():
+    text_description = request.form.get("description")
+    final_predictions = []
+
+    if text_description:
+        text_predictions = predict_disease_from_text(text_description)
+        final_predictions.extend(text_predictions)
+
+    # Get a head start on the treatment plan while the user answers follow-ups
+    likely_disease = top_prediction(final_predictions)
+    if likely_disease:
+        prefetch_treatment(likely_disease)
+
+    followup_questions = generate_followup_questions(final_predictions)
+
+    return jsonify({
+        "predictions": final_predictions,
+        "followup_questions": followup_questions
+    })
+
+@app.route("/api/final-diagnosis", methods=["POST"])
+def final_diagnosis_api():
+    data = request.json
+    predictions = data.get("predictions", [])
+    user_answers = data.get("user_answers", {})
+
+    if _wants_stream():
+        def events():
+            pieces = _final_diagnosis_pieces(predictions, user_answers)
+            yield _sse({"final_disease": next(pieces)})
+            for delta in pieces:
+                yield _sse({"delta": delta})
+            yield _sse({"done": True})
+        return _sse_response(events())
+
+    final_disease, treatment_response = _final_diagnosis_and_treatment(predictions, user_answers)
     
     return jsonify({
         "final_disease": final_disease,
@@ -135,19 +638,21 @@ Respond using this exact format. Each section should have **2–3 short bullet p
 def find_clinics():
     data = request.json
     user_location = data.get("location")
-    range_km = data.get("range", 20)
-    radius = range_km * 1000
+    try:
+        radius = float(data.get("range", 20)) * 1000
+    except (TypeError, ValueError):
+        return jsonify({"error": "Range must be a number of kilometres"}), 400
 
     if isinstance(user_location, str):
-        geocode_url = f"https://maps.googleapis.com/maps/api/geocode/json?address={user_location}&key={MAPS_API_KEY}"
-        geocode_response = requests.get(geocode_url)
-        geocode_data = geocode_response.json()
-        if geocode_data.get("status") != "OK":
+        coordinates = geocode(user_location)
+        if coordinates is None:
             return jsonify({"error": "Unable to geocode location"}), 400
-        location = geocode_data["results"][0]["geometry"]["location"]
-        lat, lng = location["lat"], location["lng"]
+        lat, lng = coordinates
     else:
-        lat, lng = user_location.get("lat"), user_location.get("lng")
+        try:
+            lat, lng = float(user_location["lat"]), float(user_location["lng"])
+        except (TypeError, KeyError, ValueError):
+            return jsonify({"error": "Location must be an address or numeric lat/lng"}), 400
     
     categories = {
         "NGO": "NGO hospital",
@@ -155,39 +660,51 @@ def find_clinics():
         "Private": "skin private hospital"
     }
     
+    # One Text Search (New) per category returns every field we need, so no
+    # per-place details lookups are required
+    searches = {
+        category: _maps_executor.submit(search_places, keyword, lat, lng, radius)
+        for category, keyword in categories.items()
+    }
+
+    results = {}
+    for category, future in searches.items():
+        try:
+            results[category] = future.result()
+        except requests.RequestException as e:
+            logger.warning("Clinic search for %s failed: %s", category, e)
+    if not results:
+        return jsonify({"error": "Unable to search for clinics"}), 502
+
+    # The same hospital often matches several category searches; keep one entry
+    # per place, with its best-ranked category first
+    by_id = {}
+    for category, places in results.items():
+        for place in places:
+            place_id = place.get("id")
+            entry = by_id.setdefault(place_id, {"place": place, "categories": []})
+            entry["categories"].append(category)
+
     clinics = []
-    for category, keyword in categories.items():
-        places_url = (
-            f"https://maps.googleapis.com/maps/api/place/nearbysearch/json?"
-            f"location={lat},{lng}&radius={radius}&type=hospital&keyword={keyword}&key={MAPS_API_KEY}"
-        )
-        places_response = requests.get(places_url)
-        places_data = places_response.json()
-        
-        for place in places_data.get("results", []):
-            place_id = place.get("place_id")
-            details_url = (
-                f"https://maps.googleapis.com/maps/api/place/details/json?"
-                f"place_id={place_id}&fields=name,formatted_address,formatted_phone_number,opening_hours,website,rating&key={MAPS_API_KEY}"
-            )
-            details_response = requests.get(details_url)
-            details_data = details_response.json().get("result", {})
-            
-            clinic = {
-                "category": category,
-                "name": place.get("name"),
-                "place_id": place.get("place_id"),
-                "address": details_data.get("formatted_address"),
-                "phone": details_data.get("formatted_phone_number"),
-                "website": details_data.get("website"),
-                "rating": place.get("rating"),
-                "location": place.get("geometry", {}).get("location", {}),
-                "hours": details_data.get("opening_hours", {}).get("weekday_text", [])
-            }
-            clinics.append(clinic)
+    for place_id, entry in by_id.items():
+        place = entry["place"]
+        categories_found = sorted(entry["categories"], key=lambda c: _CATEGORY_RANK.get(c, 999))
+        location = place.get("location", {})
+        clinic = {
+            "category": categories_found[0],
+            "categories": categories_found,
+            "name": place.get("displayName", {}).get("text"),
+            "place_id": place_id,
+            "address": place.get("formattedAddress"),
+            "phone": place.get("nationalPhoneNumber"),
+            "website": place.get("websiteUri"),
+            "rating": place.get("rating"),
+            "location": {"lat": location.get("latitude"), "lng": location.get("longitude")},
+            "hours": place.get("regularOpeningHours", {}).get("weekdayDescriptions", [])
+        }
+        clinics.append(clinic)
     
-    sorted_order = ["NGO", "Government", "Private"]
-    clinics.sort(key=lambda x: sorted_order.index(x["category"]) if x["category"] in sorted_order else 999)
+    clinics.sort(key=lambda c: _CATEGORY_RANK.get(c["category"], 999))
     
     return jsonify({"clinics": clinics})
 
@@ -199,21 +716,34 @@ def health_chat():
     if not question:
         return jsonify({"error": "Question is required"}), 400
     
-    prompt = f"""
-You are a women's health assistant. A user asked: {question}
-
-Reply with a **short, concise answer (1–2 sentences max)**. 
-Focus on:
-• Quick explanation
-• 1–2 key tips
-• When to see a doctor
-
-If the question isn't about women's health, politely decline.
-Return your response in **plain text** only.
-    """
+    normalized = _normalize_question(question)
+    cached, vector = cached_health_answer(normalized)
+    prompt = HEALTH_CHAT_TEMPLATE.substitute(question=question)
+
+    if _wants_stream():
+        def events():
+            if cached is not None:
+                yield _sse({"delta": cached})
+                yield _sse({"done": True})
+                return
+            parts = []
+            try:
+                for chunk in MODEL.generate_content(prompt, stream=True):
+                    parts.append(chunk.text)
+                    yield _sse({"delta": chunk.text})
+            except Exception as e:
+                yield _sse({"error": str(e)})
+                return
+            remember_health_answer(normalized, vector, "".join(parts).strip())
+            yield _sse({"done": True})
+        return _sse_response(events())
+
+    if cached is not None:
+        return jsonify({"response": cached})
     
     try:
-        response = genai.GenerativeModel("gemini-2.0-flash").generate_content(prompt).text.strip()
+        response = MODEL.generate_content(prompt).text.strip()
+        remember_health_answer(normalized, vector, response)
         return jsonify({"response": response})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -247,6 +777,10 @@ def index():
         if text_description:
             text_predictions = predict_disease_from_text(text_description)
             final_predictions.extend(text_predictions)
+
+        likely_disease = top_prediction(final_predictions)
+        if likely_disease:
+            prefetch_treatment(likely_disease)
         
         session["predictions"] = final_predictions
         session["followup_questions"] = generate_followup_questions(final_predictions)
@@ -275,48 +809,9 @@ def final_diagnosis_page():
     if "predictions" not in session or "user_answers" not in session:
         return redirect(url_for("index"))
     
-    prompt = f"""
-Based on these AI predictions:
-{json.dumps(session["predictions"], indent=2)}
-And user responses:
-{json.dumps(session["user_answers"], indent=2)}
-Determine the final skin disease. Return ONLY the final disease name in plain text.
-    """
-    final_disease = genai.GenerativeModel("gemini-2.0-flash").generate_content(prompt).text.strip()
-
-    treatment_prompt = f"""
-You are a medical assistant. Provide a structured and easy-to-understand treatment plan for the following skin condition:
-
-**Disease:** {final_disease}
-
-Respond using this exact format. Each section should have **2–3 short bullet points**. Keep the explanations **simple, practical, and relevant for a general audience**.
-
-**Diagnosis:** [Short explanation of the disease and how it's usually identified]
-
-**Symptoms:**
-• [Common symptom 1]
-• [Common symptom 2]
-• [Common symptom 3]
-
-**Causes:**
-• [Major cause or risk factor]
-• [Another common contributing factor]
-
-**Treatments (Ordered):**
-• Ayurvedic Solutions: [1–2 natural treatments with brief benefits]
-• Home Remedies: [1–2 things people can try at home for relief]
-• Non-Prescription Medications: [1–2 OTC products with when to use them]
-• Prescription Medications: [1–2 doctor-prescribed options and their purpose]
-
-**When to See a Doctor:**
-• [Early warning sign]
-• [Progression or worsening symptom]
-    """
-    
-    try:
-        treatment_response = genai.GenerativeModel("gemini-2.0-flash").generate_content(treatment_prompt).text.strip()
-    except Exception:
-        treatment_response = "⚠️ Unable to fetch treatment details. Please consult a dermatologist."
+    final_disease, treatment_response = _final_diagnosis_and_treatment(
+        session["predictions"], session["user_answers"]
+    )
 
     session["final_disease"] = final_disease
     return render_template(
@@ -330,7 +825,7 @@ Respond using this exact format. Each section should have **2–3 short bullet p
 def treatment():
     final_disease = session.get("final_disease", "Unknown")
     treatment_prompt = f"Provide structured diagnosis and treatment for {final_disease} in a bullet-point format."
-    treatment_plan = genai.GenerativeModel("gemini-2.0-flash").generate_content(treatment_prompt).text
+    treatment_plan = MODEL.generate_content(treatment_prompt).text
     return render_template("treatment.html", final_disease=final_disease, treatment=treatment_plan)
 
 # ------------------- Main Entry Point -------------------